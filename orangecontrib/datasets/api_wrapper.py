@@ -5,7 +5,7 @@ data manipulation and generating Orange data tables.
 """
 
 import datetime
-import time
+import functools
 import logging
 
 import numpy as np
@@ -14,8 +14,154 @@ import Orange
 import simple_wbd
 from orangecontrib.datasets import countries
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 logger = logging.getLogger(__name__)
 
+# Fallback date for unparsable wbd date strings, computed once so the
+# failure path does not hit the clock for every bad row.
+_TODAY_ISO = datetime.date.today().isoformat()
+
+
+@functools.lru_cache(maxsize=4096)
+def _iso_date(date_str):
+    """Parse a wbd date string into an iso format date string.
+
+    The same date strings repeat across every country and indicator in a
+    response, so the parse is memoized on the raw string.
+    """
+    if len(date_str) == 4 and date_str.isdigit():
+        # Plain year strings are by far the most common case; handle
+        # them without the try/except control flow below.
+        return datetime.date(int(date_str), 1, 1).isoformat()
+    try:
+        if "Q" in date_str:
+            year, quarter = date_str.split("Q")
+            return datetime.date(
+                int(year), (int(quarter) * 3) - 2, 1).isoformat()
+        elif "M" in date_str:
+            year, month = date_str.split("M")
+            return datetime.date(int(year), int(month), 1).isoformat()
+        else:
+            return datetime.date(int(date_str), 1, 1).isoformat()
+    except ValueError:
+        # some dates contain invalid date strings such as
+        # "Last Known Value" or "1988-2000" and possible some more. See:
+        # http://api.worldbank.org/countries/PRY/indicators/
+        #   per_lm_ac.avt_q4_urb?date=1960%3A2016&format=json
+        #   &per_page=10000
+        # http://api.worldbank.org/countries/all/indicators/
+        #   DB_mw_19apprentice?format=json&mrv=10&gapfill=y
+        return _TODAY_ISO
+
+
+def _to_float(value):
+    """Convert a single table cell to float, mapping missing values to NaN."""
+    if value is None or value == "":
+        return np.nan
+    return float(value)
+
+
+_to_float_ufunc = np.frompyfunc(_to_float, 1, 1)
+
+
+def _dates_to_epochs(column):
+    """Convert a column of dates to a float column of epoch seconds.
+
+    Missing dates (None) become NaN.  The conversion goes through a single
+    bulk datetime64 cast instead of per-row timetuple/mktime calls.
+    """
+    dates = np.array(column.tolist(), dtype="datetime64[s]")
+    epochs = np.empty((dates.shape[0], 1), dtype=np.float64)
+    epochs[:, 0] = dates.astype(np.int64)
+    epochs[np.isnat(dates), 0] = np.nan
+    return epochs
+
+
+def _factorize(column):
+    """Encode a categorical column into integer codes and sorted labels.
+
+    Returns a (labels, codes) pair where codes is an integer array mapping
+    every cell of the column to its index in the sorted labels list.
+    Missing cells (None) are encoded as the empty string, which sorts
+    first just as the old nonesorter key did.
+    """
+    column = np.where(column == np.array(None), "", column)
+    labels, codes = np.unique(column.astype(str), return_inverse=True)
+    # np.unique hands back int64 codes; categorical columns rarely have
+    # more than a few dozen labels, so store them as narrow integers
+    if len(labels) <= np.iinfo(np.int8).max:
+        codes = codes.astype(np.int8, copy=False)
+    elif len(labels) <= np.iinfo(np.int16).max:
+        codes = codes.astype(np.int16, copy=False)
+    return labels.tolist(), codes
+
+
+if numba is None:
+    def _nonzero_columns(vals):
+        """Boolean mask of columns with at least one non zero, non NaN cell."""
+        return np.nan_to_num(vals).any(axis=0)
+else:
+    @numba.njit(parallel=True, cache=True)
+    def _nonzero_columns(vals):
+        """Boolean mask of columns with at least one non zero, non NaN cell."""
+        mask = np.zeros(vals.shape[1], dtype=np.bool_)
+        for col in numba.prange(vals.shape[1]):  # pylint: disable=not-an-iterable
+            for row in range(vals.shape[0]):
+                value = vals[row, col]
+                # NaN compares unequal to itself
+                if value == value and value != 0.0:
+                    mask[col] = True
+                    break
+        return mask
+
+
+def _as_np_array(rows, meta_count):
+    """Convert as_list rows into a filtered 2D numpy array.
+
+    Shared implementation behind the IndicatorDataset and ClimateDataset
+    as_np_array methods.  The first meta_count columns are kept as
+    objects, data cells become float64 with NaN for missing values, and
+    data columns holding only zeros or missing values are dropped.
+    """
+    if len(rows) < 2:
+        return np.array([])
+
+    row_iter = iter(rows)
+    header = next(row_iter)
+    meta = np.empty((len(rows) - 1, meta_count), dtype=object)
+    vals = np.full((len(rows) - 1, len(header) - meta_count), np.nan,
+                   dtype=np.float64)
+    # stream rows into the preallocated arrays by index, so no per-row
+    # slice copies (and no copy of the row list) are materialized
+    for row_index, row in enumerate(row_iter):
+        for col_index in range(meta_count):
+            meta[row_index, col_index] = row[col_index]
+        for col_index in range(meta_count, len(header)):
+            try:
+                vals[row_index, col_index - meta_count] = \
+                    float(row[col_index])
+            except (TypeError, ValueError):
+                pass  # missing values ("" or None) stay NaN
+
+    # keep only data columns with at least one non zero value
+    keep = _nonzero_columns(vals)
+    data_names = header[meta_count:]
+    if not keep.all():
+        # only pay for the gather copy when a column is dropped
+        data_names = [name for name, keep_column in
+                      zip(data_names, keep) if keep_column]
+        vals = vals[:, keep]
+    data = np.empty((len(rows), meta_count + vals.shape[1]), dtype=object)
+    data[0, :meta_count] = header[:meta_count]
+    data[0, meta_count:] = data_names
+    data[1:, :meta_count] = meta
+    data[1:, meta_count:] = vals
+    return data
+
 
 class IndicatorDataset(simple_wbd.IndicatorDataset):
     """Extended indicator dataset.
@@ -32,34 +178,16 @@ class IndicatorDataset(simple_wbd.IndicatorDataset):
         Convert date strings such as "2005", "2002Q3" and "1999M7" into iso
         formatted date strings "yyyy-mm-dd"
         """
-        try:
-            if "Q" in date_str:
-                year, quarter = date_str.split("Q")
-                return datetime.date(int(year), (int(quarter) * 3) - 2, 1)
-            elif "M" in date_str:
-                year, month = date_str.split("M")
-                return datetime.date(int(year), int(month), 1)
-            else:
-                return datetime.date(int(date_str), 1, 1).isoformat()
-        except ValueError:
-            # some dates contain invalid date strings such as
-            # "Last Known Value" or "1988-2000" and possible some more. See:
-            # http://api.worldbank.org/countries/PRY/indicators/
-            #   per_lm_ac.avt_q4_urb?date=1960%3A2016&format=json
-            #   &per_page=10000
-            # http://api.worldbank.org/countries/all/indicators/
-            #   DB_mw_19apprentice?format=json&mrv=10&gapfill=y
-            return datetime.date.today().isoformat()
+        return _iso_date(date_str)
 
     def _time_series_table(self):
         data = self.as_np_array(time_series=True)
 
-        if not data.any():
+        if data.shape[0] < 2:
             return None
 
-        meta_columns = [[time.mktime(date_.timetuple()) if date_ else None]
-                        for date_ in data[1:, 0]]
-        data_columns = data[1:, 1:]
+        meta_columns = _dates_to_epochs(data[1:, 0])
+        data_columns = data[1:, 1:].astype(np.float64)
 
         meta_domains = [Orange.data.TimeVariable("Date")]
 
@@ -72,66 +200,41 @@ class IndicatorDataset(simple_wbd.IndicatorDataset):
         return Orange.data.Table(domain, data_columns, metas=meta_columns)
 
     def _country_table(self):
-
-        def nonesorter(a):
-            if not a:
-                return ""
-            return a
-
         data = self.as_np_array(add_metadata=True)
 
-        if not data.any():
+        if data.shape[0] < 2:
             return None
 
         meta_columns = data[1:, :7]
 
         data_columns = data[1:, 7:]
-        regions = {r: i for i, r in enumerate(sorted(set(meta_columns[:, 1]), key=nonesorter))}
-        admin_regions = {r: i for i, r in enumerate(sorted(set(meta_columns[:, 2]), key=nonesorter))}
-        income_level = {r: i for i, r in enumerate(sorted(set(meta_columns[:, 3]), key=nonesorter))}
-        lending_type = {r: i for i, r in enumerate(sorted(set(meta_columns[:, 6]), key=nonesorter))}
+        regions, meta_columns[:, 1] = _factorize(meta_columns[:, 1])
+        admin_regions, meta_columns[:, 2] = _factorize(meta_columns[:, 2])
+        income_level, meta_columns[:, 3] = _factorize(meta_columns[:, 3])
+        lending_type, meta_columns[:, 6] = _factorize(meta_columns[:, 6])
 
         meta_domains = [
           Orange.data.StringVariable("Country"),
-          Orange.data.DiscreteVariable(
-            "Region",
-            values=sorted(regions.keys(), key=nonesorter)
-          ),
-          Orange.data.DiscreteVariable(
-            "Admin region",
-            values=sorted(admin_regions.keys(), key=nonesorter)
-          ),
-          Orange.data.DiscreteVariable(
-            "Income level",
-            values=sorted(income_level.keys(), key=nonesorter)
-          ),
+          Orange.data.DiscreteVariable("Region", values=regions),
+          Orange.data.DiscreteVariable("Admin region", values=admin_regions),
+          Orange.data.DiscreteVariable("Income level", values=income_level),
           Orange.data.ContinuousVariable("Longitude"),
           Orange.data.ContinuousVariable("Latitude"),
-          Orange.data.DiscreteVariable(
-            "Lending type",
-            values=sorted(lending_type.keys(), key=nonesorter)
-          ),
+          Orange.data.DiscreteVariable("Lending type", values=lending_type),
         ]
         column_domains = [Orange.data.ContinuousVariable(column_name)
                          for column_name in data[0, 7:]]
-        for row in meta_columns:
-          row[1] = regions[row[1]]
-          row[2] = admin_regions[row[2]]
-          row[3] = income_level[row[3]]
-          row[6] = lending_type[row[6]]
 
         logger.debug("Generated Orange table of size: %s", data.shape)
 
         domain = Orange.data.Domain(column_domains, metas=meta_domains)
 
-        data_columns = data_columns.astype(float)
-        data_columns = np.where(data_columns == np.array(None), np.nan, data_columns)
-        data_columns = np.where(data_columns == '', np.nan, data_columns)
-        meta_columns = np.where(meta_columns == np.array(None), np.nan, meta_columns)
-        meta_columns = np.where(meta_columns == '', np.nan, meta_columns)
-        for row in meta_columns[:, 1:]:
-            row[3] = float(row[3])
-            row[4] = float(row[4])
+        data_columns = np.ascontiguousarray(data_columns, dtype=np.float64)
+        # longitude and latitude are the only meta columns that can still
+        # hold missing values; the rest are strings or factorized codes
+        meta_columns[:, 4] = _to_float_ufunc(meta_columns[:, 4])
+        meta_columns[:, 5] = _to_float_ufunc(meta_columns[:, 5])
+        meta_columns = np.ascontiguousarray(meta_columns)
 
         return Orange.data.Table(domain, data_columns, metas=meta_columns)
 
@@ -150,13 +253,10 @@ class IndicatorDataset(simple_wbd.IndicatorDataset):
         Returns:
             2D numpy array with all indicator data.
         """
-        data = np.array(self.as_list(time_series=time_series,
-                                        add_metadata=add_metadata,
-                                        **kwargs))
-
-        # list of column indexes that have at least one non zero value
-        filter_ = [ind for ind, col in enumerate(data[1:, :].T) if any(col)]
-        return data[:, filter_]
+        rows = self.as_list(time_series=time_series,
+                            add_metadata=add_metadata,
+                            **kwargs)
+        return _as_np_array(rows, 7 if add_metadata else 1)
 
     def as_orange_table(self, time_series=False):
         if time_series:
@@ -186,11 +286,7 @@ class ClimateDataset(simple_wbd.ClimateDataset):
         Returns:
             2D numpy array with all indicator data.
         """
-        data = np.array(self.as_list(**kwargs))
-
-        # list of column indexes that have at least one non zero value
-        filter_ = [ind for ind, col in enumerate(data[1:, :].T) if any(col)]
-        return data[:, filter_]
+        return _as_np_array(self.as_list(**kwargs), 1)
 
     def _country_table(self, **kwargs):
         data = self.as_np_array(**kwargs)
@@ -198,9 +294,12 @@ class ClimateDataset(simple_wbd.ClimateDataset):
             return None
         alpha3_map = countries.get_alpha3_map()
         meta_columns = data[1:, :1]
-        data_columns = data[1:, 1:]
-        for row in meta_columns:
-            row[0] = alpha3_map.get(row[0], row[0])
+        data_columns = data[1:, 1:].astype(np.float64)
+        codes, inverse = np.unique(meta_columns[:, 0].astype(str),
+                                   return_inverse=True)
+        names = np.array([alpha3_map.get(code, code) for code in codes],
+                         dtype=object)
+        meta_columns[:, 0] = names[inverse]
 
         meta_domains = [Orange.data.StringVariable(name)
                         for name in data[0, :1]]
@@ -217,12 +316,8 @@ class ClimateDataset(simple_wbd.ClimateDataset):
                                 **kwargs)
         if data.shape[0] < 2:
             return None
-        alpha3_map = countries.get_alpha3_map()
-        meta_columns = [[time.mktime(date_.timetuple()) if date_ else None]
-                        for date_ in data[1:, 0]]
-        data_columns = data[1:, 1:]
-        for row in meta_columns:
-            row[0] = alpha3_map.get(row[0], row[0])
+        meta_columns = _dates_to_epochs(data[1:, 0])
+        data_columns = data[1:, 1:].astype(np.float64)
 
         meta_domains = [Orange.data.TimeVariable(name)
                         for name in data[0, :1]]
@@ -9,6 +9,7 @@ The three main exposed functions are:
     get_alpha3_map - used for changing alpha3 codes to country names.
 """
 import copy
+import functools
 import logging
 from collections import defaultdict
 from collections import OrderedDict
@@ -405,8 +406,13 @@ def _order_countries_dict(countries):
     return OrderedDict(sorted(countries.items(), key=lambda x: x[1]["name"]))
 
 
+@functools.lru_cache(maxsize=1)
 def get_alpha3_map():
-    """Get mappings from alpha3 codes to country names."""
+    """Get mappings from alpha3 codes to country names.
+
+    The map is built from the full pycountry database, so it is computed
+    once and cached for all callers.
+    """
     name_map = {v: k for k, v in MAPPINGS.items()}
     return {c.alpha3: name_map.get(c.name, c.name)
             for c in pycountry.countries}